@@ -3,16 +3,28 @@ FastAPI-based Note Taking Application
 A local-only, self-hosted note-taking app with support for text, links, and file uploads.
 """
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional, List
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.types import Receive, Scope, Send
+from typing import Optional, List, Tuple, Dict, Any
 from pathlib import Path
 from contextlib import asynccontextmanager
-import uuid
+import asyncio
+import hashlib
+import secrets
 import mimetypes
+import time
+import tempfile
 from datetime import datetime
 import os
+import sys
+
+try:
+    import aiofiles
+except ImportError:  # aiofiles is optional; fall back to a worker thread
+    aiofiles = None
 
 import database
 
@@ -23,6 +35,118 @@ Path("data").mkdir(exist_ok=True)
 UPLOAD_DIR.mkdir(exist_ok=True)
 STATIC_DIR.mkdir(exist_ok=True)
 
+# Load the system MIME tables once so mime_for() is a plain dict lookup
+mimetypes.init()
+
+
+def mime_for(name: str) -> str:
+    """Get the MIME type for a filename from its extension."""
+    dot = name.rfind(".")
+    ext = name[dot:].lower() if dot != -1 else ""
+    return mimetypes.types_map.get(ext, "application/octet-stream")
+
+
+# Upload limits
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # 50MB
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1MB
+
+# Linux can sendfile() between regular files; other platforms need a socket
+HAS_FILE_SENDFILE = sys.platform.startswith("linux") and hasattr(os, "sendfile")
+
+# Guards stored files shared by deduplicated notes: held from the hash lookup
+# to the insert when uploading, and from the reference count to the unlink
+# when deleting
+_file_lock = asyncio.Lock()
+
+
+def _copy_upload(src, file_path: Path, digest) -> int:
+    """Copy an upload's file object to disk (blocking), hashing as it goes. Returns bytes written."""
+    total = 0
+    with open(file_path, "wb") as dst:
+        while chunk := src.read(UPLOAD_CHUNK_SIZE):
+            total += len(chunk)
+            if total > MAX_UPLOAD_SIZE:
+                break
+            digest.update(chunk)
+            dst.write(chunk)
+    return total
+
+
+def _sendfile_upload(src, file_path: Path) -> Tuple[int, str]:
+    """
+    Copy a disk-backed upload to file_path in kernel space (blocking).
+    
+    Returns (size, SHA-256 hex digest). Nothing is written if the upload
+    exceeds MAX_UPLOAD_SIZE.
+    """
+    src_fd = src.fileno()
+    size = os.fstat(src_fd).st_size
+    if size > MAX_UPLOAD_SIZE:
+        return size, ""
+    
+    dst_fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    finally:
+        os.close(dst_fd)
+    
+    # Hashing still needs the bytes, but pread() leaves the file position alone
+    digest = hashlib.sha256()
+    offset = 0
+    while chunk := os.pread(src_fd, UPLOAD_CHUNK_SIZE, offset):
+        digest.update(chunk)
+        offset += len(chunk)
+    return size, digest.hexdigest()
+
+
+def _too_large(file: UploadFile) -> HTTPException:
+    """Build the 413 error for an upload over MAX_UPLOAD_SIZE."""
+    return HTTPException(status_code=413, detail=f"File {file.filename} is too large (max 50MB)")
+
+
+async def save_upload(file: UploadFile, file_path: Path) -> Tuple[int, str]:
+    """
+    Stream an uploaded file to disk in chunks without blocking the event loop.
+    
+    Uploads that Starlette has already spooled to disk are copied with
+    sendfile() where the platform supports it.
+    
+    Raises HTTPException(413) and removes the partial file if the upload
+    exceeds MAX_UPLOAD_SIZE. Returns (bytes written, SHA-256 hex digest).
+    """
+    total = 0
+    digest = hashlib.sha256()
+    try:
+        if (HAS_FILE_SENDFILE and isinstance(file.file, tempfile.SpooledTemporaryFile)
+                and file.file._rolled):
+            # Large uploads are already spooled to a temp file on disk
+            total, file_hash = await asyncio.to_thread(_sendfile_upload, file.file, file_path)
+        elif aiofiles is not None:
+            async with aiofiles.open(file_path, "wb") as f:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    total += len(chunk)
+                    if total > MAX_UPLOAD_SIZE:
+                        break
+                    digest.update(chunk)
+                    await f.write(chunk)
+            file_hash = digest.hexdigest()
+        else:
+            total = await asyncio.to_thread(_copy_upload, file.file, file_path, digest)
+            file_hash = digest.hexdigest()
+        
+        if total > MAX_UPLOAD_SIZE:
+            await file.close()
+            raise _too_large(file)
+    except BaseException:
+        file_path.unlink(missing_ok=True)
+        raise
+    return total, file_hash
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -30,21 +154,77 @@ async def lifespan(app: FastAPI):
     # Startup
     await database.init_db()
     print("✅ Database initialized")
+    
+    # Read the UI once; it only changes on redeploy
+    index_path = STATIC_DIR / "index.html"
+    if index_path.exists():
+        app.state.index_html = index_path.read_bytes()
+        app.state.index_etag = f'"{hashlib.sha256(app.state.index_html).hexdigest()[:16]}"'
+    else:
+        app.state.index_html = None
+        app.state.index_etag = None
+    
     print(f"✅ Upload directory: {UPLOAD_DIR.absolute()}")
     print("🚀 Note-taking app is ready!")
     yield
-    # Shutdown (if needed)
+    # Shutdown
+    await database.close_db()
     print("👋 Shutting down...")
 
 
+async def _save_one(file: UploadFile) -> Dict[str, Any]:
+    """
+    Save a single upload under a unique filename.
+    
+    Returns a dict with fresh_path (the copy just written), file_path and
+    filename (what the note will point at; create_note may redirect these to
+    an identical stored file), mime_type, file_hash, and suffix (lower-cased
+    extension; dedupe only reuses files whose suffix matches).
+    """
+    # Generate unique filename
+    file_extension = Path(file.filename).suffix
+    unique_filename = f"{secrets.token_hex(16)}{file_extension}"
+    file_path = UPLOAD_DIR / unique_filename
+    
+    # Stream file to disk (enforces the 50MB limit)
+    _, file_hash = await save_upload(file, file_path)
+    
+    # Detect MIME type
+    mime_type = file.content_type or mime_for(file.filename)
+    
+    return {
+        "fresh_path": file_path,
+        "file_path": file_path,
+        "filename": unique_filename,
+        "mime_type": mime_type,
+        "file_hash": file_hash,
+        "suffix": file_extension.lower(),
+    }
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Note Taking App",
     description="Local note-taking app with text, links, and file support",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+
+class SkipFilesGZipMiddleware(GZipMiddleware):
+    """GZip responses except uploaded files, which are mostly compressed media already."""
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].startswith("/files/"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# Compress JSON and UI responses; level 5 balances CPU against ratio on a Pi
+app.add_middleware(SkipFilesGZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Enable CORS for LAN access
 app.add_middleware(
     CORSMiddleware,
@@ -55,17 +235,73 @@ app.add_middleware(
 )
 
 
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header (weak comparison, lists, or *) against an ETag."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
 @app.get("/", response_class=HTMLResponse)
-async def read_root():
-    """Serve the main HTML interface."""
-    index_path = STATIC_DIR / "index.html"
-    if index_path.exists():
-        return HTMLResponse(content=index_path.read_text(encoding='utf-8'), status_code=200)
+async def read_root(request: Request):
+    """Serve the main HTML interface (cached in memory at startup)."""
+    if app.state.index_html is not None:
+        headers = {"ETag": app.state.index_etag, "Cache-Control": "public, max-age=300"}
+        if _etag_matches(request.headers.get("if-none-match"), app.state.index_etag):
+            return Response(status_code=304, headers=headers)
+        return HTMLResponse(content=app.state.index_html, status_code=200, headers=headers)
     return HTMLResponse(content="<h1>Note Taking App</h1><p>Please create static/index.html</p>", status_code=200)
 
 
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that adds a Cache-Control header to every file it serves."""
+    
+    def __init__(self, *args, cache_control: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control
+    
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        response = await super().get_response(path, scope)
+        response.headers["Cache-Control"] = self.cache_control
+        return response
+
+
+class UploadedFiles(CachedStaticFiles):
+    """
+    Serves user uploads. Only passive media types render inline; anything
+    else (HTML, SVG, XHTML, ...) is sent as an attachment so uploaded
+    content can never run script on the app's origin.
+    """
+    
+    INLINE_PREFIXES = ("image/", "video/", "audio/")
+    INLINE_TYPES = {"application/pdf", "text/plain"}
+    # Images that can carry script are downloaded like any other document
+    ATTACHMENT_TYPES = {"image/svg+xml"}
+    
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        response = await super().get_response(path, scope)
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        # A 304 carries no Content-Type and its headers update the cached
+        # copy, so leave the disposition chosen on the full response alone
+        if response.status_code != 304:
+            content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+            inline = content_type not in self.ATTACHMENT_TYPES and (
+                content_type in self.INLINE_TYPES or content_type.startswith(self.INLINE_PREFIXES)
+            )
+            response.headers["Content-Disposition"] = "inline" if inline else "attachment"
+        return response
+
+
 # Mount static files - must be last to avoid conflicts
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# UI assets keep stable names, so they are only cached for a day
+app.mount("/static", CachedStaticFiles(directory="static", cache_control="public, max-age=86400"), name="static")
+# Uploads are stored under random names and never rewritten, so they never go stale.
+# StaticFiles also rejects any path that resolves outside the uploads directory.
+app.mount("/files", UploadedFiles(directory=UPLOAD_DIR, cache_control="public, max-age=31536000, immutable"), name="files")
 
 
 @app.post("/api/notes")
@@ -87,37 +323,59 @@ async def create_note(
     
     # Handle file uploads
     if files and len(files) > 0 and files[0].filename and files[0].filename != '':
-        for file in files:
-            if not file.filename:
-                continue
-                
-            # Validate file size (50MB limit)
-            file_content = await file.read()
-            if len(file_content) > 50 * 1024 * 1024:  # 50MB
-                raise HTTPException(status_code=413, detail=f"File {file.filename} is too large (max 50MB)")
-            
-            # Generate unique filename
-            file_extension = Path(file.filename).suffix
-            unique_filename = f"{uuid.uuid4()}{file_extension}"
-            file_path = UPLOAD_DIR / unique_filename
-            
-            # Save file to disk
-            with open(file_path, "wb") as f:
-                f.write(file_content)
-            
-            # Detect MIME type
-            mime_type = file.content_type or mimetypes.guess_type(file.filename)[0] or "application/octet-stream"
-            
-            # Create database entry
-            note_id = await database.create_note(
-                note_type="file",
-                content=content if content else None,
-                file_name=file.filename,
-                file_path=f"uploads/{unique_filename}",
-                mime_type=mime_type,
-                tags=tags
-            )
+        uploads = [file for file in files if file.filename]
+        
+        # Reject oversized files before writing anything; Starlette records the size while parsing
+        for file in uploads:
+            if file.size is not None and file.size > MAX_UPLOAD_SIZE:
+                raise _too_large(file)
+        
+        # Write all files to disk concurrently
+        results = await asyncio.gather(*(_save_one(file) for file in uploads), return_exceptions=True)
+        saved = [result for result in results if not isinstance(result, BaseException)]
+        failures = [result for result in results if isinstance(result, BaseException)]
+        
+        try:
+            if failures:
+                raise failures[0]
             
+            # Hold the file lock from the dedupe lookup until the notes are
+            # committed, so a delete can't remove a file we are about to reuse
+            async with _file_lock:
+                # Dedupe on content and extension: /files serves the type of the stored suffix
+                first_by_key = {}
+                for entry in saved:
+                    # Identical files within this request share the first copy
+                    first = first_by_key.setdefault((entry["file_hash"], entry["suffix"]), entry)
+                    if first is not entry:
+                        entry.update(file_path=first["file_path"], filename=first["filename"])
+                        continue
+                    
+                    # Reuse an identical file that is already stored
+                    existing = await database.get_file_path_by_hash(entry["file_hash"], entry["suffix"])
+                    if existing and Path(existing).exists():
+                        entry.update(file_path=Path(existing), filename=Path(existing).name)
+                
+                rows = [
+                    ("file", content if content else None, file.filename, f"uploads/{entry['filename']}",
+                     entry["mime_type"], tags, entry["file_hash"])
+                    for file, entry in zip(uploads, saved)
+                ]
+                
+                # Create all database entries in one transaction
+                note_ids = await database.create_notes_bulk(rows)
+        except BaseException:
+            # Don't leave orphaned files behind if any upload fails
+            for entry in saved:
+                entry["fresh_path"].unlink(missing_ok=True)
+            raise
+        
+        # Drop fresh copies that turned out to duplicate a stored file
+        for entry in saved:
+            if entry["file_path"] != entry["fresh_path"]:
+                entry["fresh_path"].unlink(missing_ok=True)
+        
+        for note_id, file in zip(note_ids, uploads):
             created_notes.append({
                 "id": note_id,
                 "note_type": "file",
@@ -162,7 +420,7 @@ async def create_note(
 
 
 @app.get("/api/notes")
-async def get_notes(limit: int = 100, offset: int = 0, search: Optional[str] = None):
+async def get_notes(limit: int = 100, offset: int = 0, search: Optional[str] = None, summary: bool = False):
     """
     Retrieve all notes, newest first.
     
@@ -170,13 +428,16 @@ async def get_notes(limit: int = 100, offset: int = 0, search: Optional[str] = N
     - limit: Maximum number of notes to return (default: 100)
     - offset: Number of notes to skip for pagination (default: 0)
     - search: Optional search query to filter notes
+    - summary: Return only summary fields plus a content preview (ignored when searching)
     """
     if search:
         notes = await database.search_notes(search, limit)
+        total = await database.get_note_count()
+    elif summary:
+        notes = await database.get_all_notes_summary(limit, offset)
+        total = await database.get_note_count()
     else:
-        notes = await database.get_all_notes(limit, offset)
-    
-    total = await database.get_note_count()
+        notes, total = await database.get_notes_with_total(limit, offset)
     
     return {
         "success": True,
@@ -203,27 +464,33 @@ async def get_note(note_id: int):
 
 @app.delete("/api/notes/{note_id}")
 async def delete_note(note_id: int):
-    """Delete a note by ID. Also deletes associated file if it exists."""
+    """Delete a note by ID. Also deletes associated file if no other note uses it."""
     # Get note to check if it has an associated file
     note = await database.get_note_by_id(note_id)
     
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
     
-    # Delete file if it exists
-    if note.get("file_path"):
-        file_path = Path(note["file_path"])
-        if file_path.exists():
-            try:
-                file_path.unlink()
-            except Exception as e:
-                print(f"⚠️ Could not delete file {file_path}: {e}")
-    
-    # Delete from database
-    deleted = await database.delete_note(note_id)
-    
-    if not deleted:
-        raise HTTPException(status_code=404, detail="Note not found")
+    # Same lock as create_note's dedupe, so no upload can reuse the file
+    # between counting its references and unlinking it
+    async with _file_lock:
+        # Delete from database
+        deleted = await database.delete_note(note_id)
+        
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Note not found")
+        
+        # Deduplicated uploads share a file, so keep it while other notes use it
+        shared = note.get("file_hash") and await database.count_notes_with_file(note["file_hash"], note["file_path"]) > 0
+        
+        # Delete file if it exists
+        if note.get("file_path") and not shared:
+            file_path = Path(note["file_path"])
+            if file_path.exists():
+                try:
+                    file_path.unlink()
+                except Exception as e:
+                    print(f"⚠️ Could not delete file {file_path}: {e}")
     
     return {
         "success": True,
@@ -231,42 +498,39 @@ async def delete_note(note_id: int):
     }
 
 
-@app.get("/files/{filename}")
-async def serve_file(filename: str):
-    """Serve uploaded files with proper MIME types."""
-    # Prevent directory traversal attacks
-    if ".." in filename or "/" in filename or "\\" in filename:
-        raise HTTPException(status_code=400, detail="Invalid filename")
-    
-    file_path = UPLOAD_DIR / filename
-    
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="File not found")
-    
-    # Detect MIME type
-    mime_type = mimetypes.guess_type(str(file_path))[0] or "application/octet-stream"
-    
-    return FileResponse(
-        path=file_path,
-        media_type=mime_type,
-        filename=filename
-    )
+# (time.time() when last formatted, ISO timestamp) reused within the same second
+_last_ts = (0.0, "")
 
 
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint."""
+    global _last_ts
+    now = time.time()
+    if int(now) != int(_last_ts[0]):
+        _last_ts = (now, datetime.utcfromtimestamp(int(now)).isoformat())
+    
     note_count = await database.get_note_count()
     return {
         "status": "healthy",
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": _last_ts[1],
         "note_count": note_count
     }
 
 
 if __name__ == "__main__":
+    import importlib.util
     import uvicorn
     print("🚀 Starting Note-Taking App...")
     print("📝 Access the app at: http://0.0.0.0:8000")
     print("📱 From other devices: http://<your-pi-ip>:8000")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvloop and httptools come with uvicorn[standard]; uvloop is unavailable on Windows.
+    # Keep a single worker: the note cache and count live in this process.
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
+        limit_concurrency=64
+    )
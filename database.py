@@ -2,31 +2,134 @@
 Database module for note-taking app using SQLite.
 Handles all database operations with async support.
 """
+import asyncio
 import aiosqlite
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from pathlib import Path
 
 DATABASE_PATH = "data/notes.db"
 
+# The trigram tokenizer only indexes sequences of 3+ characters, so shorter
+# queries fall back to a LIKE scan.
+FTS_MIN_QUERY_LENGTH = 3
+
+# Long-lived connection shared by all queries, opened in init_db()
+_db: Optional[aiosqlite.Connection] = None
+
+# Serializes write transactions on the shared connection
+_write_lock = asyncio.Lock()
+
+# In-process caches. Every write goes through this module, so they stay
+# consistent as long as a single process owns the database.
+NOTE_CACHE_SIZE = 1024
+_note_cache: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+_note_count: Optional[int] = None
+# Bumped on every write so reads that raced a write don't cache stale rows
+_cache_generation = 0
+
+
+def _invalidate_note(note_id: int):
+    """Drop a note from the cache and invalidate in-flight reads."""
+    global _cache_generation
+    _cache_generation += 1
+    _note_cache.pop(note_id, None)
+
+
+def _bump_note_count(delta: int):
+    """Adjust the cached note count after a write."""
+    global _note_count
+    if _note_count is not None:
+        _note_count += delta
+
 
 async def init_db():
-    """Initialize the database and create tables if they don't exist."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS notes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                note_type TEXT NOT NULL,
-                content TEXT,
-                file_name TEXT,
-                file_path TEXT,
-                mime_type TEXT,
-                tags TEXT,
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL
-            )
-        """)
-        await db.commit()
+    """Open the shared connection and create tables if they don't exist."""
+    global _db, _note_count
+    if _db is None:
+        _db = await aiosqlite.connect(DATABASE_PATH)
+        _db.row_factory = aiosqlite.Row
+    
+    db = _db
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            note_type TEXT NOT NULL,
+            content TEXT,
+            file_name TEXT,
+            file_path TEXT,
+            mime_type TEXT,
+            tags TEXT,
+            file_hash TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    """)
+    
+    # Add columns introduced after the original schema
+    async with db.execute("PRAGMA table_info(notes)") as cursor:
+        columns = {row["name"] for row in await cursor.fetchall()}
+    if "file_hash" not in columns:
+        await db.execute("ALTER TABLE notes ADD COLUMN file_hash TEXT")
+    
+    # Connection tuning and indexes
+    await db.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA mmap_size=268435456;
+        PRAGMA cache_size=-20000;
+        
+        -- Timeline index: list queries walk it newest first instead of sorting
+        DROP INDEX IF EXISTS idx_notes_created_at;
+        DROP INDEX IF EXISTS idx_notes_list;
+        CREATE INDEX IF NOT EXISTS idx_notes_timeline ON notes(created_at DESC, id DESC);
+        CREATE INDEX IF NOT EXISTS idx_notes_file_hash ON notes(file_hash);
+    """)
+    
+    # Full-text index for search, kept in sync with notes via triggers
+    async with db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'notes_fts'"
+    ) as cursor:
+        fts_exists = await cursor.fetchone() is not None
+    
+    await db.executescript("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+            content, tags, file_name,
+            content='notes', content_rowid='id', tokenize='trigram'
+        );
+        
+        CREATE TRIGGER IF NOT EXISTS notes_ai AFTER INSERT ON notes BEGIN
+            INSERT INTO notes_fts(rowid, content, tags, file_name)
+            VALUES (new.id, new.content, new.tags, new.file_name);
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS notes_ad AFTER DELETE ON notes BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, content, tags, file_name)
+            VALUES ('delete', old.id, old.content, old.tags, old.file_name);
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS notes_au AFTER UPDATE ON notes BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, content, tags, file_name)
+            VALUES ('delete', old.id, old.content, old.tags, old.file_name);
+            INSERT INTO notes_fts(rowid, content, tags, file_name)
+            VALUES (new.id, new.content, new.tags, new.file_name);
+        END;
+    """)
+    
+    # Index notes that were created before the FTS table existed
+    if not fts_exists:
+        await db.execute("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')")
+    
+    # Refresh planner statistics so the new indexes get picked up
+    await db.execute("ANALYZE")
+    await db.commit()
+    
+    # Start the in-process caches from what is on disk
+    _note_cache.clear()
+    _note_count = None
+    await get_note_count()
 
 
 async def create_note(
@@ -35,7 +138,8 @@ async def create_note(
     file_name: Optional[str] = None,
     file_path: Optional[str] = None,
     mime_type: Optional[str] = None,
-    tags: Optional[str] = None
+    tags: Optional[str] = None,
+    file_hash: Optional[str] = None
 ) -> int:
     """
     Create a new note in the database.
@@ -47,21 +151,63 @@ async def create_note(
         file_path: Relative path to stored file
         mime_type: MIME type of the file
         tags: Comma-separated tags
+        file_hash: SHA-256 hex digest of the stored file
     
     Returns:
         ID of the created note
     """
     now = datetime.utcnow().isoformat()
     
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cursor = await db.execute("""
-            INSERT INTO notes (note_type, content, file_name, file_path, mime_type, tags, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (note_type, content, file_name, file_path, mime_type, tags, now, now))
-        await db.commit()
+    async with _write_lock:
+        try:
+            cursor = await _db.execute("""
+                INSERT INTO notes (note_type, content, file_name, file_path, mime_type, tags, file_hash, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (note_type, content, file_name, file_path, mime_type, tags, file_hash, now, now))
+            await _db.commit()
+        except BaseException:
+            # The connection is shared, so never leave a failed write pending
+            await _db.rollback()
+            raise
+        _bump_note_count(1)
         return cursor.lastrowid
 
 
+async def create_notes_bulk(rows: List[Tuple]) -> List[int]:
+    """
+    Create several notes in a single transaction.
+    
+    Args:
+        rows: Tuples of (note_type, content, file_name, file_path, mime_type, tags, file_hash)
+    
+    Returns:
+        IDs of the created notes, in the same order as rows
+    """
+    if not rows:
+        return []
+    
+    now = datetime.utcnow().isoformat()
+    
+    async with _write_lock:
+        try:
+            await _db.executemany("""
+                INSERT INTO notes (note_type, content, file_name, file_path, mime_type, tags, file_hash, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(*row, now, now) for row in rows])
+            async with _db.execute("SELECT last_insert_rowid()") as cursor:
+                last_id = (await cursor.fetchone())[0]
+            await _db.commit()
+        except BaseException:
+            # All or nothing: the id range and count below assume the whole batch
+            await _db.rollback()
+            raise
+        _bump_note_count(len(rows))
+    
+    # Rows inserted in one transaction get consecutive AUTOINCREMENT ids
+    first_id = last_id - len(rows) + 1
+    return [first_id + i for i in range(len(rows))]
+
+
 async def get_all_notes(limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
     """
     Retrieve all notes, newest first.
@@ -73,15 +219,56 @@ async def get_all_notes(limit: int = 100, offset: int = 0) -> List[Dict[str, Any
     Returns:
         List of note dictionaries
     """
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("""
-            SELECT * FROM notes
-            ORDER BY created_at DESC
-            LIMIT ? OFFSET ?
-        """, (limit, offset)) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    async with _db.execute("""
+        SELECT * FROM notes
+        ORDER BY created_at DESC, id DESC
+        LIMIT ? OFFSET ?
+    """, (limit, offset)) as cursor:
+        rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
+
+
+async def get_all_notes_summary(limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    Retrieve lightweight note summaries for the timeline, newest first.
+    
+    Full content and file paths are left out; fetch a note by ID for those.
+    
+    Args:
+        limit: Maximum number of notes to return
+        offset: Number of notes to skip (for pagination)
+    
+    Returns:
+        List of dictionaries with id, note_type, file_name, mime_type, tags,
+        created_at, and a short preview of the content
+    """
+    async with _db.execute("""
+        SELECT id, note_type, file_name, mime_type, tags, created_at,
+               substr(content, 1, 100) AS preview
+        FROM notes
+        ORDER BY created_at DESC, id DESC
+        LIMIT ? OFFSET ?
+    """, (limit, offset)) as cursor:
+        rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
+
+
+async def get_notes_with_total(limit: int = 100, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Retrieve a page of notes, newest first, together with the total note count.
+    
+    The page is an index walk on idx_notes_timeline and the total comes from the
+    in-memory note count, so this costs a single SQL query.
+    
+    Args:
+        limit: Maximum number of notes to return
+        offset: Number of notes to skip (for pagination)
+    
+    Returns:
+        Tuple of (list of note dictionaries, total number of notes)
+    """
+    notes = await get_all_notes(limit, offset)
+    return notes, await get_note_count()
 
 
 async def get_note_by_id(note_id: int) -> Optional[Dict[str, Any]]:
@@ -94,13 +281,26 @@ async def get_note_by_id(note_id: int) -> Optional[Dict[str, Any]]:
     Returns:
         Note dictionary or None if not found
     """
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("""
-            SELECT * FROM notes WHERE id = ?
-        """, (note_id,)) as cursor:
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+    note = _note_cache.get(note_id)
+    if note is not None:
+        _note_cache.move_to_end(note_id)
+        return dict(note)
+    
+    generation = _cache_generation
+    async with _db.execute("""
+        SELECT * FROM notes WHERE id = ?
+    """, (note_id,)) as cursor:
+        row = await cursor.fetchone()
+    
+    if not row:
+        return None
+    
+    note = dict(row)
+    if generation == _cache_generation:
+        _note_cache[note_id] = note
+        if len(_note_cache) > NOTE_CACHE_SIZE:
+            _note_cache.popitem(last=False)
+    return dict(note)
 
 
 async def delete_note(note_id: int) -> bool:
@@ -113,41 +313,103 @@ async def delete_note(note_id: int) -> bool:
     Returns:
         True if deleted, False if not found
     """
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cursor = await db.execute("DELETE FROM notes WHERE id = ?", (note_id,))
-        await db.commit()
+    async with _write_lock:
+        try:
+            cursor = await _db.execute("DELETE FROM notes WHERE id = ?", (note_id,))
+            await _db.commit()
+        except BaseException:
+            await _db.rollback()
+            raise
+        _invalidate_note(note_id)
+        if cursor.rowcount > 0:
+            _bump_note_count(-1)
         return cursor.rowcount > 0
 
 
 async def search_notes(query: str, limit: int = 100) -> List[Dict[str, Any]]:
     """
-    Search notes by content or tags.
+    Search notes by content, tags, or filename.
+    
+    Uses the trigram FTS index for substring matching; queries shorter than
+    three characters fall back to a LIKE scan.
     
     Args:
         query: Search query string
         limit: Maximum number of results
     
     Returns:
-        List of matching note dictionaries
+        List of matching note dictionaries, best matches first
     """
-    search_pattern = f"%{query}%"
-    
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("""
+    if len(query) < FTS_MIN_QUERY_LENGTH:
+        search_pattern = f"%{query}%"
+        sql = """
             SELECT * FROM notes
             WHERE content LIKE ? OR tags LIKE ? OR file_name LIKE ?
-            ORDER BY created_at DESC
+            ORDER BY created_at DESC, id DESC
             LIMIT ?
-        """, (search_pattern, search_pattern, search_pattern, limit)) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+        """
+        params = (search_pattern, search_pattern, search_pattern, limit)
+    else:
+        # Quote the query as a single FTS5 string so operators and
+        # punctuation in user input are matched literally
+        fts_query = '"' + query.replace('"', '""') + '"'
+        sql = """
+            SELECT n.* FROM notes n
+            JOIN notes_fts f ON n.id = f.rowid
+            WHERE notes_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        """
+        params = (fts_query, limit)
+    
+    async with _db.execute(sql, params) as cursor:
+        rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
+
+
+async def get_file_path_by_hash(file_hash: str, suffix: str) -> Optional[str]:
+    """
+    Get the stored path of a file with the given SHA-256 digest and extension, if any.
+    
+    The extension has to match too, because /files picks the served
+    Content-Type (and inline vs. attachment) from the stored file's suffix.
+    
+    Args:
+        file_hash: SHA-256 hex digest of the file
+        suffix: Lower-cased file extension including the dot, or "" for none
+    """
+    async with _db.execute("""
+        SELECT DISTINCT file_path FROM notes WHERE file_hash = ?
+    """, (file_hash,)) as cursor:
+        rows = await cursor.fetchall()
+    for row in rows:
+        if Path(row["file_path"]).suffix.lower() == suffix:
+            return row["file_path"]
+    return None
+
+
+async def count_notes_with_file(file_hash: str, file_path: str) -> int:
+    """Count notes that point at a stored file (looked up through its hash index)."""
+    async with _db.execute("""
+        SELECT COUNT(*) FROM notes WHERE file_hash = ? AND file_path = ?
+    """, (file_hash, file_path)) as cursor:
+        row = await cursor.fetchone()
+        return row[0] if row else 0
 
 
 async def get_note_count() -> int:
-    """Get total number of notes in the database."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute("SELECT COUNT(*) FROM notes") as cursor:
+    """Get total number of notes, counted once and then kept in memory."""
+    global _note_count
+    if _note_count is None:
+        async with _db.execute("SELECT COUNT(*) FROM notes") as cursor:
             row = await cursor.fetchone()
-            return row[0] if row else 0
+            _note_count = row[0] if row else 0
+    return _note_count
+
 
+async def close_db():
+    """Close the shared database connection."""
+    global _db
+    if _db is not None:
+        await _db.close()
+        _db = None
@@ -1,27 +1,30 @@
 """
 Generate PWA icons for the note-taking app
 Run this once to create the icons: python generate_icons.py
+Requires Pillow and numpy: pip install pillow numpy
 """
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
+import numpy as np
 import os
 
+BACKGROUND = (0x63, 0x66, 0xf1)  # #6366f1
+OUTLINE = (0x4f, 0x46, 0xe5)     # #4f46e5
+NOTE_COLOR = (0xff, 0xff, 0xff)  # #ffffff
+LINE_COLOR = (0x63, 0x66, 0xf1)  # #6366f1
+
 def create_icon(size, output_path):
     """Create a simple icon with the note emoji/symbol"""
-    # Create image with gradient background
-    img = Image.new('RGB', (size, size), color='#6366f1')
-    draw = ImageDraw.Draw(img)
+    # Fill the pixel buffer with the background color
+    arr = np.full((size, size, 3), BACKGROUND, dtype=np.uint8)
     
     # Draw a simple notepad shape
     margin = size // 8
-    note_color = '#ffffff'
+    outline_width = size // 40
     
-    # Draw note rectangle
-    draw.rectangle(
-        [margin, margin, size - margin, size - margin],
-        fill=note_color,
-        outline='#4f46e5',
-        width=size // 40
-    )
+    # Draw note rectangle (bounds are inclusive, as with ImageDraw.rectangle)
+    arr[margin:size - margin + 1, margin:size - margin + 1] = OUTLINE
+    inner = slice(margin + outline_width, size - margin + 1 - outline_width)
+    arr[inner, inner] = NOTE_COLOR
     
     # Draw lines to simulate text
     line_margin = margin * 2
@@ -30,13 +33,10 @@ def create_icon(size, output_path):
     
     for i in range(3):
         y = line_margin + margin + (i * line_spacing)
-        draw.rectangle(
-            [line_margin, y, size - line_margin, y + line_width],
-            fill='#6366f1'
-        )
+        arr[y:y + line_width + 1, line_margin:size - line_margin + 1] = LINE_COLOR
     
-    # Save the image
-    img.save(output_path, 'PNG')
+    # Save the image; these are tiny generated assets, so favor fast encoding
+    Image.fromarray(arr).save(output_path, 'PNG', optimize=False, compress_level=1)
     print(f'✅ Created {output_path}')
 
 if __name__ == '__main__':